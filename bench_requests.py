@@ -0,0 +1,244 @@
+#!/usr/bin/env python3.7
+
+# ******************************************
+#  Dev:  marius-joe
+# ******************************************
+#  Benchmarks of the request utilities
+#  v1.0.0
+# ******************************************
+
+
+"""
+Benchmarks of utils_requests against a local stand-in server (no internet needed):
+    - xSession request path: requests/s and time per request, live on the local server and replayed from a cassette
+      (the replay has no network part, so the difference to a plain requests.Session shows the overhead of xSession)
+    - memory of the request path and of streamed vs fully parsed json arrays (tracemalloc peaks)
+    - session save/load per session format
+    - downloads: throughput of single stream and segmented downloads
+Run as module of the package, e.g.:
+    python -m Python_collection.bench_requests --num_requests=2000 --download_MB=64 --path_output=bench.json
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests  # req: https://github.com/kennethreitz/requests
+import fire  # req: https://github.com/google/python-fire
+
+from . import utils_requests
+from . import utils_requests_replay
+from . import utils_io
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in server:
+        /json            small json document
+        /items           json document with an array of items under 'items'
+        /file            binary data, with range requests
+    The large bodies are built once at the start, the server runs in the benchmark process and
+    would otherwise add its own allocations to the memory peaks of the client.
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive, like real servers
+    disable_nagle_algorithm = True  # headers and body are written separately, Nagle would delay every response by ~40 ms
+    file_data = b""
+    items_data = b""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        if self.path == "/json":
+            self._send(200, "application/json", b'{"id":1,"name":"stand-in","tags":["a","b","c"]}')
+        elif self.path == "/items":
+            self._send(200, "application/json", self.items_data)
+        elif self.path == "/file":
+            data = self.file_data
+            headers = {"Accept-Ranges": "bytes", "ETag": '"stand-in"'}
+            match_range = re.match(r'bytes=(\d+)-(\d*)', self.headers.get("Range", ""))
+            if match_range:
+                first = int(match_range.group(1))
+                last = int(match_range.group(2)) if match_range.group(2) else len(data) - 1
+                headers["Content-Range"] = f"bytes {first}-{last}/{len(data)}"
+                self._send(206, "application/octet-stream", data[first:last + 1], headers)
+            else:
+                self._send(200, "application/octet-stream", data, headers)
+        else:
+            self._send(404, "text/plain", b"not found")
+
+
+def start_server(download_MB=16, num_items=100000):
+    """
+    Start the stand-in server in a background thread, returns (server, base_url)
+    """
+    items = ",".join('{"id":%d,"name":"item %d","value":%d.5}' % (i, i, i) for i in range(num_items))
+    handler = type("StandInHandler", (_StandInHandler,), {
+        'file_data': os.urandom(download_MB * 1024 * 1024),
+        'items_data': ('{"items":[%s]}' % items).encode('utf-8'),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _time_calls(func, num_calls):
+    time_start = time.perf_counter()
+    for _ in range(num_calls):
+        func()
+    time_total = time.perf_counter() - time_start
+    return {'requests_per_s': round(num_calls / time_total, 1), 'per_request_us': round(time_total / num_calls * 1e6, 1)}
+
+
+def bench_request_path(base_url, path_cassette, num_requests=1000):
+    """
+    Requests/s and time per request of xSession.request compared to a plain requests.Session, live and replayed
+    """
+    results = {}
+    session_plain = requests.Session()
+    session_plain.trust_env = False
+    session_x = utils_requests.xSession(base_url)
+    results['live_plain'] = _time_calls(lambda: session_plain.get(base_url + "/json").json(), num_requests)
+    results['live_xSession'] = _time_calls(lambda: session_x.request('get', "/json"), num_requests)
+
+    # record once, then replay at full speed: what remains is the client side work
+    utils_requests_replay.mount_cassette(session_plain, path_cassette, mode='record')
+    session_plain.get(base_url + "/json")
+    utils_requests_replay.mount_cassette(session_plain, path_cassette, mode='replay')
+    utils_requests_replay.mount_cassette(session_x, path_cassette, mode='replay')
+    results['replay_plain'] = _time_calls(lambda: session_plain.get(base_url + "/json").json(), num_requests)
+    results['replay_xSession'] = _time_calls(lambda: session_x.request('get', "/json"), num_requests)
+    results['xSession_overhead_us'] = round(
+        results['replay_xSession']['per_request_us'] - results['replay_plain']['per_request_us'], 1
+    )
+    return results
+
+
+def _get_peak_KB(func):
+    tracemalloc.start()
+    try:
+        func()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(base_url, num_requests=1000):
+    """
+    Peak memory (KB) of many requests on one xSession and of a large json array, fully parsed vs streamed
+    """
+    session_x = utils_requests.xSession(base_url)
+    url_items = "/items"
+
+    def run_requests():
+        for _ in range(num_requests):
+            session_x.request('get', "/json")
+
+    def run_stream():
+        for _ in session_x.request('get', url_items, response_mode='stream', json_path='items')['data']:
+            pass
+
+    return {
+        'requests_peak_KB': _get_peak_KB(run_requests),
+        'items_json_peak_KB': _get_peak_KB(lambda: session_x.request('get', url_items, response_mode='json')),
+        'items_stream_peak_KB': _get_peak_KB(run_stream),
+    }
+
+
+def bench_sessions(path_folder, num_cookies=200, num_calls=50):
+    """
+    Save and load times (ms) and file sizes of a session with 'num_cookies' cookies per session format
+    """
+    results = {}
+    for session_format in utils_requests.C_SessionFormats:
+        writer = utils_requests.RequestsSessionWriter(
+            os.path.join(path_folder, f"session_{session_format}"), session_format=session_format
+        )
+        session = writer.get_session()
+        for i in range(num_cookies):
+            session.cookies.set(f"cookie_{i}", f"value_{i}" * 4, domain="example.com", path="/")
+        time_start = time.perf_counter()
+        for _ in range(num_calls):
+            writer.save_session()
+        time_saved = time.perf_counter()
+        for _ in range(num_calls):
+            writer._read_session()
+        time_loaded = time.perf_counter()
+        results[session_format] = {
+            'save_ms': round((time_saved - time_start) / num_calls * 1000, 3),
+            'load_ms': round((time_loaded - time_saved) / num_calls * 1000, 3),
+            'size_KB': round(os.path.getsize(writer.path_session) / 1024, 1),
+        }
+    return results
+
+
+def bench_downloads(base_url, path_folder, download_MB=16, segments=(1, 4)):
+    """
+    Throughput (MB/s) of download_file as a single stream and in byte range segments
+    """
+    results = {}
+    for num_segments in segments:
+        path_downloads = os.path.join(path_folder, f"downloads_{num_segments}")
+        utils_io.ensure_path(path_downloads)
+        session = requests.Session()
+        session.trust_env = False
+        utils_requests.mount_http_adapter(session, pool_maxsize=max(num_segments, 10))
+        time_start = time.perf_counter()
+        path_file = utils_requests.download_file(
+            session, f"{base_url}/file", path_downloads, file_name="download.bin",
+            segments=num_segments, segment_min_MB=1,
+        )
+        time_total = time.perf_counter() - time_start
+        results[f"segments_{num_segments}"] = {
+            'MB_per_s': round(download_MB / time_total, 1),
+            'seconds': round(time_total, 3),
+            'complete': bool(path_file) and os.path.getsize(path_file) == download_MB * 1024 * 1024,
+        }
+    return results
+
+
+def run_benchmarks(num_requests=1000, num_items=100000, num_cookies=200, download_MB=16, path_output=""):
+    """
+    Run all benchmarks against a fresh stand-in server, print the results and optionally save them as json
+    """
+    server, base_url = start_server(download_MB, num_items)
+    path_folder = tempfile.mkdtemp(prefix="bench_requests_")
+    try:
+        results = {
+            'request_path': bench_request_path(base_url, os.path.join(path_folder, "bench.cassette.jsonl.gz"), num_requests),
+            'memory': bench_memory(base_url, num_requests),
+            'sessions': bench_sessions(path_folder, num_cookies),
+            'downloads': bench_downloads(base_url, path_folder, download_MB),
+        }
+    finally:
+        server.shutdown()
+        shutil.rmtree(path_folder, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if path_output:
+        utils_io.write_file(path_output, results, mode='json', indent=2)
+    return None
+
+
+if __name__ == "__main__":
+    sys.exit(fire.Fire(run_benchmarks))
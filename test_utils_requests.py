@@ -0,0 +1,59 @@
+import os
+import json
+
+import requests
+
+from . import utils_requests
+
+
+def test_iter_json_items_every_chunk_size():
+    # numbers cut after their '.' or 'e' by a chunk boundary must not be decoded as the shorter number
+    items = [2500.0, -1.5e-07, 3e+20, 0, 12.25, True, None, "a,b]", {"x": [1.0, 2e3]}]
+    document = json.dumps({"skip": [7.5, 1e10], "data": {"items": items}}).encode('utf-8')
+    for chunk_size in range(1, len(document) + 1):
+        chunks = [document[i:i + chunk_size] for i in range(0, len(document), chunk_size)]
+        assert list(utils_requests.iter_json_items(chunks, 'data.items')) == items, chunk_size
+
+
+def test_iter_json_items_bare_numbers():
+    numbers = [i + 0.5 for i in range(300)] + [1.25e-5, 2500.0]
+    document = json.dumps(numbers).encode('utf-8')
+    for chunk_size in range(1, len(document) + 1):
+        chunks = [document[i:i + chunk_size] for i in range(0, len(document), chunk_size)]
+        assert list(utils_requests.iter_json_items(chunks)) == numbers, chunk_size
+
+
+def test_cookie_list_round_trip():
+    cookiejar = requests.cookies.RequestsCookieJar()
+    cookiejar.set('a', "1", domain="example.com", path="/")
+    cookiejar.set('b', "2", domain=".example.com", path="/x", secure=True, expires=2000000000)
+    cookiejar.set('c', "3", domain="example.com", rest={})
+    cookie_list = utils_requests.get_cookie_list(cookiejar)
+    assert cookie_list[0] == {'name': 'a', 'value': "1", 'domain': "example.com"}  # only the non-default attributes
+
+    cookiejar_loaded = requests.cookies.RequestsCookieJar()
+    utils_requests.set_cookies(cookiejar_loaded, cookie_list)
+    assert [vars(cookie) for cookie in cookiejar_loaded] == [vars(cookie) for cookie in cookiejar]
+
+
+def test_session_pickled_by_earlier_version_is_migrated(tmp_path):
+    path_folder = str(tmp_path / "session")
+    writer = utils_requests.RequestsSessionWriter(path_folder, session_timeout_minutes=60, session_format='pickle')
+    writer.get_session().cookies.set('login', "x", domain="example.com")
+    writer.save_session()
+
+    writer = utils_requests.RequestsSessionWriter(path_folder, session_timeout_minutes=60)
+    assert writer.load_session()
+    assert writer.session.cookies.get('login') == "x"
+    assert os.path.exists(writer.path_session)
+
+
+def test_snapshot_pruning_keeps_newest_good(tmp_path):
+    writer = utils_requests.RequestsSessionWriter(str(tmp_path / "session"), num_session_versions=2, need_login=True)
+    writer.get_session()
+    for is_good in (False, False, True, False, False):
+        writer.save_session(is_good=is_good)
+    versions = writer._read_versions()
+    assert versions == {'latest': 5, 'good': [3]}
+    assert os.path.exists(writer._get_path_snapshot(3))
+    assert not os.path.exists(writer._get_path_snapshot(2))
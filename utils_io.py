@@ -4,7 +4,7 @@
 #  Dev:  marius-joe
 # ******************************************
 #  Utilities for file operations
-#  v0.9.3
+#  v0.12.0
 # ******************************************
 
 """Utilities for file operations"""
@@ -16,6 +16,12 @@ from stat import ST_DEV, ST_INO, ST_MTIME
 import contextlib
 
 import json
+import tempfile
+import time
+import hashlib
+import shutil
+import codecs
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import fire  # req: https://github.com/google/python-fire
 
 # currently not working
@@ -24,46 +30,320 @@ import fire  # req: https://github.com/google/python-fire
 class FileProcessor:
     """
     File processor to do task on single files or the content of a folder.
-    If the input is a folder, all of the files in that folder will be proccessed.
+    If the input is a folder, all of the files in that folder (and its subfolders) will be proccessed.
+    The folder tree is walked lazily and the files are handed to a pool while walking, so huge folders start at once
+    and only 'max_pending' files are queued at a time:
+        'executor': 'thread' (for io bound actions), 'process' (cpu bound actions, the processor has to be picklable) or 'serial'
+    _file_actions() returns the result of a file (e.g. the path of the written output file),
+    iter_process_files() yields them as they complete, process_files() collects them in 'output_files'.
+    Files whose actions fail are logged and kept in 'failed_files' [(path_file, error)], the others go on.
+    With 'incremental' a manifest in the output folder remembers the processed files (mtime, size and with 'use_hash'
+    a content hash), so the next run skips the unchanged ones ('skipped_files'). Inputs, that have been deleted since,
+    are removed from the manifest and reported with the result of their last run in 'stale_outputs' [(path_file, result)].
     """
 
-    def __init__(self, path_input, path_output_folder, restrict_ext):
+    def __init__(self, path_input, path_output_folder, restrict_ext, executor='thread', max_workers=None, max_pending=None, recursive=True,
+                 incremental=False, use_hash=False):
+        if executor not in ('thread', 'process', 'serial'):
+            raise ValueError(f"Invalid executor: {executor}")
+        self.path_input = path_input
         self.path_output_folder = path_output_folder
         self.output_files = []
+        self.failed_files = []
         self.restrict_ext = restrict_ext
+        self.executor = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.recursive = recursive
+        self.incremental = incremental
+        self.use_hash = use_hash
+        self.skipped_files = []
+        self.stale_outputs = []
+
+    def __getstate__(self):
+        # the workers of a process pool only need the settings, not the (large) bookkeeping of the run
+        state = self.__dict__.copy()
+        for name in ('output_files', 'failed_files', 'skipped_files', 'stale_outputs', '_manifest', '_file_states', '_files_seen'):
+            state.pop(name, None)
+        return state
 
     def _file_actions(self, path_file):
         pass  # implement actions here, when the FileProcessor is inherited
 
-    def process_files(self, path_input, path_output_folder, restrict_ext):
-        # For the case those values have been changed through a direct call of this function
-        self.path_output_folder = path_output_folder
-        self.xlFileFormat = xlFileFormat
-
-        if os.path.exists(path_input):
-            if os.path.isfile(path_input) and path_input.endswith(restrict_ext):
-                path_file = path_input
-                self._file_actions()
-
-            elif os.path.isdir(path_input):
-                for file_name in os.listdir(path_input):
-                    if file_name.endswith(restrict_ext):
-                        path_file = os.path.join(path_input, file_name)
-                        self._file_actions()
+    def _process_file(self, path_file, hash_previous=None):
+        """
+        Runs in the worker: hashes the file (with 'use_hash'), so reading the files is spread over the pool too,
+        and does the file actions unless the content is the same as in the last run.
+        Returns (is_unchanged, result, file_hash)
+        """
+        file_hash = get_file_hash(path_file) if (self.incremental and self.use_hash) else None
+        if hash_previous and file_hash == hash_previous:
+            return True, None, file_hash
+        return False, self._file_actions(path_file), file_hash
+
+    def process_files(self, path_input=None, path_output_folder=None, restrict_ext=None):
+        """
+        Process all files and return the list of results (e.g. output files) in 'output_files'
+        """
+        for path_file, result in self.iter_process_files(path_input, path_output_folder, restrict_ext):
+            if result is not None:
+                self.output_files.append(result)
         return self.output_files
 
-
-def convert_utf8bom(path_file, path_new_file=""):
+    def iter_process_files(self, path_input=None, path_output_folder=None, restrict_ext=None):
+        """
+        Generator of (path_file, result) in the order the files are finished
+        """
+        # For the case those values have been changed through a direct call of this function
+        if path_input is not None:
+            self.path_input = path_input
+        if path_output_folder is not None:
+            self.path_output_folder = path_output_folder
+        if restrict_ext is not None:
+            self.restrict_ext = restrict_ext
+
+        files = walk_files(self.path_input, self.restrict_ext, self.recursive)
+        if not self.incremental:
+            yield from self._run_file_actions(files)
+            return
+
+        self._load_manifest()
+        try:
+            yield from self._run_file_actions(self._filter_changed_files(files))
+            self._remove_stale_files()
+        finally:
+            # also after an interruption, so the finished files don't have to be processed again
+            self._save_manifest()
+
+    def _run_file_actions(self, files):
+        if self.executor == 'serial':
+            for path_file in files:
+                try:
+                    outcome = self._process_file(path_file, self._get_hash_previous(path_file))
+                except Exception as err:
+                    self._add_failed_file(path_file, err)
+                else:
+                    yield from self._add_outcome(path_file, outcome)
+            return
+
+        PoolExecutor = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        with PoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            for path_file in files:
+                pending[executor.submit(self._process_file, path_file, self._get_hash_previous(path_file))] = path_file
+                # bounded queue: walk on only when there is room again
+                if len(pending) >= self.max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from self._collect_done(done, pending)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from self._collect_done(done, pending)
+
+    def _collect_done(self, done, pending):
+        for future in done:
+            path_file = pending.pop(future)
+            try:
+                outcome = future.result()
+            except Exception as err:
+                self._add_failed_file(path_file, err)
+            else:
+                yield from self._add_outcome(path_file, outcome)
+
+    def _get_hash_previous(self, path_file):
+        # only set for files whose size is unchanged but mtime is not, see _filter_changed_files
+        return self._file_states[path_file].pop('hash_previous', None) if self.incremental else None
+
+    def _add_outcome(self, path_file, outcome):
+        is_unchanged, result, file_hash = outcome
+        if is_unchanged:
+            # e.g. copied or touched again: a new mtime, but the same content
+            self._manifest[self._get_manifest_key(path_file)]['mtime_ns'] = self._file_states.pop(path_file)['mtime_ns']
+            self.skipped_files.append(path_file)
+            return
+        if file_hash is not None:
+            self._file_states[path_file]['hash'] = file_hash
+        yield self._add_processed_file(path_file, result)
+
+    def _add_processed_file(self, path_file, result):
+        if self.incremental:
+            entry = self._file_states.pop(path_file)
+            # only json values can be kept for the report of stale outputs
+            entry['result'] = result if isinstance(result, (str, int, float, bool, type(None))) else str(result)
+            self._manifest[self._get_manifest_key(path_file)] = entry
+        return path_file, result
+
+    def _add_failed_file(self, path_file, err):
+        logging.warning(f"File could not be processed:  {path_file}  ({err})")
+        self.failed_files.append((path_file, err))
+        if self.incremental:
+            # not in the manifest, so it's tried again by the next run
+            self._file_states.pop(path_file, None)
+
+    def get_path_manifest(self):
+        return os.path.join(self.path_output_folder, f".{type(self).__name__}.manifest.json")
+
+    def _get_path_base(self):
+        return self.path_input if os.path.isdir(self.path_input) else os.path.dirname(self.path_input)
+
+    def _get_manifest_key(self, path_file):
+        # relative to the input, so the manifest stays valid if the input folder is moved
+        return os.path.relpath(path_file, self._path_base)
+
+    def _load_manifest(self):
+        self._path_base = self._get_path_base()
+        self._manifest = read_file(self.get_path_manifest(), mode='json') or {}
+        self._file_states = {}  # state of the files being processed, they enter the manifest when they are done
+        self._files_seen = set()
+
+    def _save_manifest(self):
+        ensure_path(self.path_output_folder)
+        write_file(self.get_path_manifest(), self._manifest, mode='json', atomic=True)
+
+    def _filter_changed_files(self, files):
+        """
+        Pass on only the files, that are new or changed since they were processed the last time.
+        With 'use_hash' the files are hashed by the workers (see _process_file), not while walking.
+        """
+        for path_file in files:
+            key = self._get_manifest_key(path_file)
+            self._files_seen.add(key)
+            try:
+                stat_file = os.stat(path_file)
+            except OSError:
+                continue  # deleted while walking
+            state = {'mtime_ns': stat_file.st_mtime_ns, 'size': stat_file.st_size}
+            entry = self._manifest.get(key)
+            if entry and entry['size'] == state['size']:
+                if entry['mtime_ns'] == state['mtime_ns']:
+                    self.skipped_files.append(path_file)
+                    continue
+                if self.use_hash and entry.get('hash'):
+                    # the worker compares the content and skips the actions, if it's the same
+                    state['hash_previous'] = entry['hash']
+            self._file_states[path_file] = state
+            yield path_file
+
+    def _remove_stale_files(self):
+        for key in [key for key in self._manifest if key not in self._files_seen]:
+            path_file = os.path.join(self._path_base, key)
+            if not os.path.exists(path_file):
+                entry = self._manifest.pop(key)
+                self.stale_outputs.append((path_file, entry.get('result')))
+                logging.info(f"Input deleted, its output is stale:  {path_file}  ->  {entry.get('result')}")
+
+
+def get_file_hash(path_file, block_size=1024 * 1024):
+    hash_file = hashlib.blake2b(digest_size=16)
+    with open(path_file, 'rb') as fi:
+        for block in iter(lambda: fi.read(block_size), b""):
+            hash_file.update(block)
+    return hash_file.hexdigest()
+
+
+def walk_files(path_input, restrict_ext="", recursive=True):
+    """
+    Generator of the file paths to process: 'path_input' itself if it's a file, otherwise the files of the folder tree.
+    The folders are read lazily with os.scandir and the files are filtered by 'restrict_ext' (str or tuple) while walking.
+    """
+    if os.path.isfile(path_input):
+        if path_input.endswith(restrict_ext):
+            yield path_input
+        return
+    folders = [path_input]
+    while folders:
+        path_folder = folders.pop()
+        try:
+            with os.scandir(path_folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            folders.append(entry.path)
+                    elif entry.name.endswith(restrict_ext) and entry.is_file():
+                        yield entry.path
+        except OSError as err:  # e.g. no permission, the rest of the tree is still processed
+            logging.warning(f"Folder could not be read:  {path_folder}  ({err})")
+
+
+# v2.0
+def convert_utf8bom(path_file, path_new_file="", block_size=8 * 1024 * 1024):
+    """
+    Convert a UTF-8-BOM file to UTF-8 (without BOM), the content is copied byte by byte (line endings are kept).
+    Only the first 3 bytes are checked, the rest is copied in blocks (zero-copy by the os, where available),
+    so the memory usage doesn't depend on the file size.
+    The output is written to a temp file, that replaces 'path_new_file' at once, so 'path_new_file' can be 'path_file' itself.
+    """
     if not path_new_file:
         path_new_file = path_file
-    # reading with 'utf-8-sig' ensures, that also UTF-8-BOM can be processed
-    with open(path_file, 'r', encoding='utf-8-sig') as fi:
-        text = fi.read()
-    with open(path_new_file, 'w', encoding='utf-8') as fo:
-        fo.write(text)
+    path_temp = None
+    try:
+        with open(path_file, 'rb') as fi:
+            offset = len(codecs.BOM_UTF8) if fi.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8 else 0
+            if not offset and os.path.abspath(path_new_file) == os.path.abspath(path_file):
+                return path_new_file  # already without BOM
+            fd, path_temp = tempfile.mkstemp(
+                prefix=os.path.basename(path_new_file) + ".", suffix=".~tmp~", dir=os.path.dirname(path_new_file) or "."
+            )
+            with os.fdopen(fd, 'wb') as fo:
+                _copy_file_content(fi, fo, offset, block_size)
+        # the input has to be closed first, Windows can't replace a file that is still open
+        shutil.copymode(path_file, path_temp)
+        os.replace(path_temp, path_new_file)
+    finally:
+        if path_temp:
+            remove_if_exists(path_temp)
     return path_new_file
 
 
+def _copy_file_content(fi, fo, offset, block_size):
+    """
+    Copy the content of the opened file 'fi' from 'offset' on to the opened file 'fo':
+    with copy_file_range / sendfile the data doesn't pass through python, otherwise it's copied in blocks
+    """
+    size_copy = os.fstat(fi.fileno()).st_size - offset
+    copied = 0
+    zero_copy_functions = []
+    if hasattr(os, 'copy_file_range'):
+        zero_copy_functions.append(lambda count: os.copy_file_range(fi.fileno(), fo.fileno(), count, offset + copied))
+    if sys.platform.startswith('linux'):  # elsewhere sendfile only writes to sockets
+        zero_copy_functions.append(lambda count: os.sendfile(fo.fileno(), fi.fileno(), offset + copied, count))
+    for zero_copy in zero_copy_functions:
+        try:
+            while copied < size_copy:
+                num_bytes = zero_copy(min(block_size, size_copy - copied))
+                if num_bytes == 0:
+                    break
+                copied += num_bytes
+            break
+        except OSError:
+            pass  # not supported for these files (e.g. other file systems), try the next way from where it stopped
+    if copied < size_copy:
+        # copy in blocks, all of it without zero-copy or the rest from where it stopped
+        fi.seek(offset + copied)
+        shutil.copyfileobj(fi, fo, block_size)
+
+
+def convert_utf8bom_folder(path_input, restrict_ext=(".csv", ".txt"), path_output_folder="", recursive=True, max_workers=None):
+    """
+    Batch mode of convert_utf8bom for a whole folder (tree), the files are converted in place or,
+    with 'path_output_folder', written there in the same folder structure.
+    Returns the paths of the converted files
+    """
+    converter = _Utf8BomConverter(
+        path_input, path_output_folder, restrict_ext, executor='thread', max_workers=max_workers, recursive=recursive
+    )
+    return converter.process_files()
+
+
+class _Utf8BomConverter(FileProcessor):
+    # overwrite
+    def _file_actions(self, path_file):
+        if not self.path_output_folder:
+            return convert_utf8bom(path_file)
+        path_new_file = os.path.join(self.path_output_folder, os.path.relpath(path_file, self._get_path_base()))
+        ensure_path(os.path.dirname(path_new_file))
+        return convert_utf8bom(path_file, path_new_file)
+
+
 def html_to_json(path_file, encoding='utf-8', indent=None):
     # reading with 'utf-8-sig' ensures, that also UTF-8-BOM can be processed
     with open(path_file, 'r', encoding='utf-8-sig') as fi:
@@ -131,19 +411,50 @@ def jsonEscapeText(text, encoding='utf-8', indent=None):
     return get_jsonStr_escaped([text])
 
 
-# v1.1
-def write_file(path_file, output, mode='text', encoding='utf-8', indent=None):
+# v1.3
+# atomic: write to a temp file first and replace the target, so readers never see a half written file
+# mode 'bytes' writes the output as it is in binary mode
+def write_file(path_file, output, mode='text', encoding='utf-8', indent=None, atomic=False):
     path_output = path_file
     #path_output = os.path.expanduser(path_file)
     if mode == 'json':
         content = get_jsonStr(output, encoding=encoding, indent=indent)
-    elif isinstance(output, str):
+    elif isinstance(output, (str, bytes)):
         content = output
     elif isinstance(output, list):
         content = "".join(output)
 
-    with open(path_output, 'w', encoding=encoding) as fo:
-        fo.write(content)
+    if atomic:
+        # unique temp file in the target folder, so concurrent writers don't share it and the rename stays on one drive
+        fd, path_output = tempfile.mkstemp(prefix=os.path.basename(path_file) + ".", suffix=".~tmp~", dir=os.path.dirname(path_file) or ".")
+        os.close(fd)
+    try:
+        if mode == 'bytes':
+            with open(path_output, 'wb') as fo:
+                fo.write(content)
+        else:
+            with open(path_output, 'w', encoding=encoding) as fo:
+                fo.write(content)
+        if atomic:
+            replace_file(path_output, path_file)
+    finally:
+        if atomic:
+            remove_if_exists(path_output)
+
+
+def replace_file(path_source, path_target, num_tries=50, delay_ms=20):
+    """
+    os.replace, that is tried again for a moment if the target is in use:
+    on Windows a file can't be replaced while another process has it open (e.g. a worker reading the saved session)
+    """
+    for num_try in range(1, num_tries + 1):
+        try:
+            os.replace(path_source, path_target)
+            return
+        except PermissionError:
+            if num_try == num_tries:
+                raise
+            time.sleep(delay_ms / 1000)
 
 
 # v1.3
@@ -168,6 +479,39 @@ def read_file(path_file, mode='text', encoding='utf-8-sig'):
     return result
 
 
+@contextlib.contextmanager
+def lock_file(path_lock):
+    """
+    Hold an exclusive lock on 'path_lock' that works across processes, blocks until the lock is free.
+    Yields the opened lock file (binary, read/write), so small states can be stored in the lock file itself.
+    """
+    # 'r+b' without truncating an existing file (append mode would ignore seek() for writes)
+    fo = os.fdopen(os.open(path_lock, os.O_RDWR | os.O_CREAT), 'r+b')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            fo.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fo.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after 10 seconds, so keep trying
+        else:
+            import fcntl
+            fcntl.flock(fo.fileno(), fcntl.LOCK_EX)
+        yield fo
+    finally:
+        # buffered writes have to reach the file while it's still locked
+        fo.flush()
+        if os.name == 'nt':
+            fo.seek(0)
+            msvcrt.locking(fo.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fo.fileno(), fcntl.LOCK_UN)
+        fo.close()
+
+
 def ensure_path(path):
     import pathlib
     pathlib.Path(path).mkdir(parents=True, exist_ok=True)
@@ -38,7 +38,8 @@ class ExcelDoc_Editor(utils_io.FileProcessor):
         restrict_ext=".xlsx",
         xlFileFormat="xlWorkbookDefault",
     ):
-        super().__init__(path_input, path_output_folder, restrict_ext)
+        # one Excel application instance can't work on several documents at once
+        super().__init__(path_input, path_output_folder, restrict_ext, executor='serial')
 
         self.output_files = []
         self.replacements = replacements
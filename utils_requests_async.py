@@ -0,0 +1,149 @@
+#!/usr/bin/env python3.7
+
+# ******************************************
+#  Dev:  marius-joe
+# ******************************************
+#  Utilities for asynchronous request sessions
+#  v1.0.0
+# ******************************************
+
+
+"""
+Asynchronous counterpart to utils_requests.xSession:
+    - requests with relative urls on a specified base_url
+    - parameter authentication (e.g. an API key) like utils_requests.ParamAuth
+    - the same {'data', 'errorCodes'} result dict and expectCode check
+    - bounded-concurrency gather/map helpers to fan out many requests
+"""
+
+import asyncio
+import logging
+
+import aiohttp  # req: https://github.com/aio-libs/aiohttp
+
+from . import utils_general
+
+
+C_Codes_Created = 201
+
+
+class xSessionAsync:
+    """
+    Asynchronous session that allows setting a base url (like for an API) and doing following requests with relative urls.
+    Use it as an async context manager, so the underlying connection pool is closed properly:
+      async with xSessionAsync(base_url, api_auth={'key': ...}) as session:
+          results = await session.map('get', ['/items/1', '/items/2'], max_concurrency=20)
+    """
+    def __init__(self, base_url, api_auth=None, auth_method='param', user_agent="Mozilla/5.0 (Windows NT 6.1; WOW64; rv:40.0) Gecko/20100101 Firefox/40.1", max_concurrency=10, limit_per_host=0, timeout_s=None):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {"user-agent": user_agent}
+        self.auth_params = api_auth if (api_auth and auth_method == 'param') else None
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.timeout_s = timeout_s
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            # the connector limits the open sockets, so it is sized for the wanted concurrency
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.limit_per_host)
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout_s),
+                trust_env=False,
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method='get', url="", expectCode={'post': C_Codes_Created}, debug=False, **kwargs):
+        results = {'data': None, 'errorCodes': []}
+        if (method == 'head'): kwargs.setdefault('allow_redirects', False)
+        if self.auth_params:
+            # attach the auth parameters to the url parameters, like ParamAuth does for the sync session
+            kwargs['params'] = {**(kwargs.get('params') or {}), **self.auth_params}
+        session = await self.open()
+        try:
+            if self.base_url and url.startswith('/'): url = self.base_url + url
+            async with session.request(method, url, **kwargs) as response:
+                # raise exception in case of invalid request
+                if (method in expectCode) and (response.status != expectCode[method]):
+                    raise aiohttp.ClientError(f"[ExpectCode_Error] response.status = {response.status}")
+                else:
+                    response.raise_for_status()
+                    # if everything is good until here, save the response data
+                    try:
+                        results['data'] = await response.json(content_type=None)
+                    except ValueError:
+                        pass
+
+                if debug:
+                    logging.info(debug_response(response))
+
+        except aiohttp.ClientResponseError as err_h:
+            results['errorCodes'].append(err_h)
+        except aiohttp.ClientConnectionError as err_c:
+            results['errorCodes'].append(err_c)
+        except asyncio.TimeoutError as err_t:
+            results['errorCodes'].append(err_t)
+        except aiohttp.ClientError as err:
+            results['errorCodes'].append(err)
+
+        if debug and results['data']:
+            logging.info("request_data:  " + "\n" + utils_general.get_jsonStr(results['data'], indent=2) + "\n")
+
+        return results
+
+    async def gather(self, requests, max_concurrency=None):
+        """
+        Run many requests concurrently, but never more than max_concurrency at once.
+        'requests' is an iterable of dicts with the keyword arguments of request(), e.g. {'method': 'get', 'url': '/items/1'}
+        The results are returned in the order of the given requests.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def run_bounded(request_kwargs):
+            async with semaphore:
+                return await self.request(**request_kwargs)
+
+        return await asyncio.gather(*(run_bounded(request_kwargs) for request_kwargs in requests))
+
+    async def map(self, method, urls, max_concurrency=None, **kwargs):
+        """
+        Send the same kind of request to many (relative) urls, e.g. map('get', ['/items/1', '/items/2'])
+        """
+        return await self.gather(
+            ({'method': method, 'url': url, **kwargs} for url in urls), max_concurrency
+        )
+
+
+def run_map(base_url, method, urls, api_auth=None, max_concurrency=10, **kwargs):
+    """
+    Synchronous entry point for scripts: fan out the requests on a fresh event loop and return the results
+    """
+    async def run():
+        async with xSessionAsync(base_url, api_auth=api_auth, max_concurrency=max_concurrency) as session:
+            return await session.map(method, urls, **kwargs)
+
+    return asyncio.run(run())
+
+
+def debug_response(response):
+    """
+    Debug inforamtion about the received response: status, server data, own send data e.g. useragent
+    """
+    response_info = "response.status:  " + str(response.status) + "\n" + \
+                    "response.headers:" + "\n" + utils_general.get_jsonStr(dict(response.headers), indent=2) + "\n" + \
+                    "response.request_info.headers:" + "\n" + utils_general.get_jsonStr(dict(response.request_info.headers), indent=2)
+    return response_info
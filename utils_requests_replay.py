@@ -0,0 +1,192 @@
+#!/usr/bin/env python3.7
+
+# ******************************************
+#  Dev:  marius-joe
+# ******************************************
+#  Utilities for recording and replaying request sessions
+#  v1.0.0
+# ******************************************
+
+
+"""
+Record real http exchanges of a requests session to a cassette file and replay them without a server:
+    - the CassetteAdapter is mounted like the xHTTPAdapter, so xSession, RequestsLogin and download_file work unchanged
+    - compact cassette: one json line per exchange, gzip compressed, text bodies as text and binary bodies as base64
+    - replay at full speed or with the recorded latencies
+    - cookies of replayed responses reach the session cookie jar like the ones of real responses
+"""
+
+import os
+import io
+import gzip
+import json
+import base64
+import hashlib
+import threading
+import time
+import http.client
+
+import requests  # req: https://github.com/kennethreitz/requests
+from urllib3.response import HTTPResponse
+from urllib3._collections import HTTPHeaderDict
+
+from . import utils_requests
+
+
+C_Cassette_Modes = ('record', 'replay', 'auto')
+
+# headers of the original response that don't fit the stored (already decoded) body
+C_Headers_Dropped = ('content-encoding', 'transfer-encoding', 'content-length')
+
+
+class CassetteAdapter(utils_requests.xHTTPAdapter):
+    """
+    HTTP adapter that records the exchanges to 'path_cassette' or replays them from there.
+    'mode':
+        'record': send every request to the server and append the exchange to the cassette
+        'replay': answer only from the cassette, a request without recording raises a ConnectionError
+        'auto':   replay the recorded requests, send and record the others
+    A request is identified by its method, url, body and the 'match_headers' (e.g. the Range of segmented downloads).
+    Repeated identical requests get the recorded responses in their order (the last one is repeated).
+    'replay_latency' = True waits the recorded time until each response, otherwise the replay runs at full speed.
+      adapter = mount_cassette(session, "api.cassette.jsonl.gz", mode='auto')
+    """
+    def __init__(
+        self,
+        path_cassette,
+        mode='replay',
+        replay_latency=False,
+        match_headers=('Range', 'If-Range'),
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+    ):
+        if mode not in C_Cassette_Modes:
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        super().__init__(pool_connections, pool_maxsize, pool_block)
+        self.path_cassette = path_cassette
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.match_headers = match_headers
+        self._lock = threading.Lock()
+        self._exchanges = {}  # request key: recorded exchanges
+        self._replay_index = {}  # request key: number of replayed exchanges
+        if mode != 'record':
+            self.load()
+
+    def load(self):
+        """
+        (Re)load the exchanges of the cassette file
+        """
+        exchanges = {}
+        if os.path.exists(self.path_cassette):
+            with gzip.open(self.path_cassette, 'rt', encoding='utf-8') as fi:
+                for line in fi:
+                    if line.strip():
+                        exchange = json.loads(line)
+                        exchanges.setdefault(exchange['key'], []).append(exchange)
+        with self._lock:
+            self._exchanges = exchanges
+            self._replay_index = {}
+
+    def get_key(self, request):
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        body_hash = hashlib.sha1(body).hexdigest() if isinstance(body, bytes) else ""
+        headers = [f"{name}={request.headers[name]}" for name in self.match_headers if name in request.headers]
+        return " ".join(filter(None, [request.method, request.url, body_hash, *headers]))
+
+    # overwrite
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = self.get_key(request)
+        if self.mode != 'record':
+            with self._lock:
+                exchanges = self._exchanges.get(key)
+                if exchanges:
+                    index = self._replay_index.get(key, 0)
+                    self._replay_index[key] = index + 1
+                    exchange = exchanges[min(index, len(exchanges) - 1)]
+            if exchanges:
+                if self.replay_latency:
+                    time.sleep(exchange['elapsed_s'])
+                return self._build_replay_response(request, exchange)
+            if self.mode == 'replay':
+                raise requests.exceptions.ConnectionError(f"No recorded response in the cassette for:  {key}", request=request)
+
+        time_start = time.perf_counter()
+        response = super().send(request, stream, timeout, verify, cert, proxies)
+        # the body is read completely for the recording, it stays available for iter_content() etc.
+        content = response.content
+        self._record(key, response, content, time.perf_counter() - time_start)
+        return response
+
+    def _record(self, key, response, content, elapsed_s):
+        try:
+            body, body_encoding = content.decode('utf-8'), 'text'
+        except UnicodeDecodeError:
+            body, body_encoding = base64.b64encode(content).decode('ascii'), 'base64'
+        exchange = {
+            'key': key,
+            'status': response.status_code,
+            'reason': response.reason,
+            # pairs, so repeated headers like Set-Cookie are kept
+            'headers': [
+                [name, value] for name, value in response.raw.headers.items()
+                if name.lower() not in C_Headers_Dropped
+            ],
+            'body': body,
+            'body_encoding': body_encoding,
+            'elapsed_s': round(elapsed_s, 6),
+        }
+        line = json.dumps(exchange, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with self._lock:
+            self._exchanges.setdefault(key, []).append(exchange)
+            # every append is a gzip member of its own, gzip reads them as one stream
+            with gzip.open(self.path_cassette, 'at', encoding='utf-8') as fo:
+                fo.write(line)
+
+    def _build_replay_response(self, request, exchange):
+        if exchange['body_encoding'] == 'base64':
+            content = base64.b64decode(exchange['body'])
+        else:
+            content = exchange['body'].encode('utf-8')
+        headers = HTTPHeaderDict()
+        # the cookie handling of requests reads the headers of the original http.client response
+        message = http.client.HTTPMessage()
+        for name, value in exchange['headers']:
+            headers.add(name, value)
+            message[name] = value
+        headers['Content-Length'] = str(len(content))
+        raw = HTTPResponse(
+            body=io.BytesIO(content),
+            headers=headers,
+            status=exchange['status'],
+            reason=exchange['reason'],
+            preload_content=False,
+            decode_content=False,
+            original_response=_ReplayedResponse(message),
+        )
+        return self.build_response(request, raw)
+
+
+class _ReplayedResponse:
+    """Stand-in for the http.client response, only its header message is used"""
+    def __init__(self, msg):
+        self.msg = msg
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def mount_cassette(session, path_cassette, mode='replay', replay_latency=False, **adapter_options):
+    """
+    Replace the adapters of a requests session (e.g. an xSession or the session of a RequestsLogin) by a CassetteAdapter
+    """
+    adapter = CassetteAdapter(path_cassette, mode, replay_latency, **adapter_options)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter